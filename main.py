@@ -2,86 +2,78 @@
 
 from __future__ import annotations
 from typing import List, Dict, Optional
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import lru_cache
+import itertools
+import logging
+import time
 import uuid
 
+logger = logging.getLogger(__name__)
+
+# Caché de casefolding de direcciones: las mismas direcciones se buscan una y
+# otra vez en los caminos calientes, y .lower() recorre tabla Unicode por carácter.
+_lower_email = lru_cache(maxsize=4096)(str.lower)
+
+# Generador de ids locales al proceso: un contador monótono es mucho más barato
+# que construir un UUID (evita la lectura de /dev/urandom por mensaje).
+_next_id = itertools.count().__next__
+
+# Las banderas forman un vocabulario chico y cerrado ('leído', 'importante', ...):
+# cada nombre recibe un bit y los mensajes guardan un int en lugar de un set.
+_FLAG_BITS: Dict[str, int] = {}
+
+def _flag_bit(flag: str) -> int:
+  """Devuelve el bit asignado a la bandera, registrándola si es nueva."""
+  bit = _FLAG_BITS.get(flag)
+  if bit is None:
+    bit = 1 << len(_FLAG_BITS)
+    _FLAG_BITS[flag] = bit
+  return bit
+
 # --------------------------------------------------------------------------------------------------------------------------------------- Class Mensaje
 class Mensaje:
   """
   Representa un mensaje de correo electrónico.
   Cada mensaje tiene un remitente, una lista de destinatarios, asunto, cuerpo, un identificador único y una marca de tiempo.
-  Permite marcar/desmarcar flags (por ejemplo, leído, importante).
+  El mensaje es inmutable y puede compartirse entre bandejas: las banderas
+  (leído, importante, ...) son estado de cada Usuario, no del mensaje.
   """
+  __slots__ = ('id', 'remitente', 'destinatarios', 'asunto', '_asunto_cf', 'cuerpo', 'timestamp_ns')
+
   def __init__(self, remitente: str, destinatarios: List[str], asunto: str, cuerpo: str):
     """
     Inicializa un nuevo mensaje con los datos proporcionados.
-    El id se genera automáticamente y la fecha es la actual (UTC).
-    """
-    self._id = str(uuid.uuid4()) # Identificador único del mensaje
-    self._remitente = remitente
-    self._destinatarios = list(destinatarios)
-    self._asunto = asunto
-    self._cuerpo = cuerpo
-    self._timestamp = datetime.utcnow()
-    self._flags = set()
-
-  #--------------------------------------------------------------------------------------------------------------------------------------- Propiedades de solo lectura
-  """
-  Propiedades de solo lectura para los atributos del mensaje.
-  Permiten acceder a los datos pero no modificarlos directamente.
-  """
-  @property
-  def id(self) -> str:
-    """Devuelve el identificador único del mensaje."""
-    return self._id
-
-  @property
-  def remitente(self) -> str:
-    """Devuelve el email del remitente."""
-    return self._remitente
-
-  @property
-  def destinatarios(self) -> List[str]:
-    """Devuelve la lista de destinatarios."""
-    return list(self._destinatarios)
-
-  @property
-  def asunto(self) -> str:
-    """Devuelve el asunto del mensaje."""
-    return self._asunto
-
-  @property
-  def cuerpo(self) -> str:
-    """Devuelve el cuerpo del mensaje."""
-    return self._cuerpo
-
-  @property
-  def timestamp(self) -> datetime:
-    """Devuelve la fecha y hora de creación del mensaje."""
-    return self._timestamp
-
-  # Métodos para banderas (flags)
-  def marcar(self, flag: str) -> None:
-    """
-    Marca el mensaje con una bandera (por ejemplo, 'leído', 'importante').
+    El id se genera automáticamente (contador local al proceso) y la fecha es la actual (UTC).
+    Los atributos son públicos y de solo lectura por convención: leerlos es
+    una carga directa de slot, sin pasar por el despacho de una property.
     """
-    self._flags.add(flag)
+    self.id = _next_id().to_bytes(8, 'big') # Id único en el proceso: bytes de tamaño fijo, baratos de hashear
+    self.remitente = remitente
+    self.destinatarios = tuple(destinatarios) # Inmutable: se puede devolver sin copiar
+    self.asunto = asunto
+    self._asunto_cf = asunto.casefold().encode('utf-8') # Asunto normalizado, para búsqueda a nivel de bytes
+    self.cuerpo = cuerpo
+    self.timestamp_ns = time.time_ns() # Época UNIX en ns: más barato que un datetime y ordena como int
 
-  def desmarcar(self, flag: str) -> None:
+  @classmethod
+  def from_remote(cls, remitente: str, destinatarios: List[str], asunto: str, cuerpo: str) -> 'Mensaje':
     """
-    Elimina una bandera del mensaje.
+    Crea un mensaje con un id UUID, único entre servidores.
+    Usar cuando el mensaje deba identificarse fuera de este proceso.
     """
-    self._flags.discard(flag)
+    mensaje = cls(remitente, destinatarios, asunto, cuerpo)
+    mensaje.id = uuid.uuid4().bytes
+    return mensaje
 
-  def tiene_flag(self, flag: str) -> bool:
-    """
-    Verifica si el mensaje tiene una bandera específica.
-    """
-    return flag in self._flags
+  @property
+  def timestamp(self) -> datetime:
+    """Devuelve la fecha y hora de creación del mensaje (UTC), construida bajo demanda."""
+    return datetime.fromtimestamp(self.timestamp_ns / 1e9, tz=timezone.utc)
 
   def __repr__(self) -> str:
     """Representación legible del mensaje para depuración."""
-    return f"<Mensaje {self._id[:8]} {self._asunto!r} from={self._remitente}>"
+    return f"<Mensaje {self.id.hex()[:8]} {self.asunto!r} from={self.remitente}>"
 
 # --------------------------------------------------------------------------------------------------------------------------------------- Carpeta
 class Carpeta:
@@ -89,12 +81,21 @@ class Carpeta:
   Representa una carpeta de mensajes (por ejemplo, INBOX, SENT, TRASH).
   Puede contener mensajes.
   """
+  __slots__ = ('_nombre', '_mensajes', '_token_index', '_version', '_buscar_cache')
+
   def __init__(self, nombre: str):
     """
-    Inicializa la carpeta con un nombre y una lista vacía de mensajes.
+    Inicializa la carpeta con un nombre y sin mensajes.
+    Los mensajes viven en un dict id -> Mensaje: altas y bajas por id en O(1)
+    y recorrido en orden de inserción, sin índices laterales ni tombstones.
     """
     self._nombre = nombre
-    self._mensajes: List[Mensaje | Carpeta] = []
+    self._mensajes: Dict[bytes, Mensaje] = {} # Ordenado por inserción (dict de CPython 3.7+)
+    self._token_index: Dict[bytes, set] = {} # Índice invertido: palabra del asunto -> ids de mensajes
+    # Caché de consultas calientes, con clave (versión, clave normalizada): al
+    # incrementarse la versión en cada alta/baja, las entradas viejas caducan solas
+    self._version = 0
+    self._buscar_cache = lru_cache(maxsize=256)(self._buscar_sin_cache)
 
   @property
   def nombre(self) -> str:
@@ -105,30 +106,85 @@ class Carpeta:
     """
     Agrega un mensaje a la carpeta.
     """
-    self._mensajes.append(mensaje)
-
-  def eliminar(self, mensaje_id: str) -> bool:
-    """
-    Elimina un mensaje por su id. Devuelve True si se eliminó, False si no se encontró.
-    """
-    for i, m in enumerate(self._mensajes):
-      if m.id == mensaje_id:
-        del self._mensajes[i]
-        return True
-    return False
+    self._mensajes[mensaje.id] = mensaje
+    for token in mensaje._asunto_cf.split():
+      self._token_index.setdefault(token, set()).add(mensaje.id)
+    self._version += 1
+
+  def agregar_lote(self, mensajes: List[Mensaje]) -> None:
+    """
+    Agrega varios mensajes de una vez con un único update del dict,
+    actualizando el índice invertido en el mismo recorrido.
+    """
+    self._mensajes.update((m.id, m) for m in mensajes)
+    token_index = self._token_index
+    for mensaje in mensajes:
+      for token in mensaje._asunto_cf.split():
+        token_index.setdefault(token, set()).add(mensaje.id)
+    self._version += 1
+
+  def eliminar(self, mensaje_id: bytes) -> bool:
+    """
+    Elimina un mensaje por su id en O(1). Devuelve True si se eliminó,
+    False si no se encontró.
+    """
+    mensaje = self._mensajes.pop(mensaje_id, None)
+    if mensaje is None:
+      return False
+    # Mantener el índice invertido de asuntos al día
+    for token in mensaje._asunto_cf.split():
+      postings = self._token_index.get(token)
+      if postings is not None:
+        postings.discard(mensaje_id)
+        if not postings:
+          del self._token_index[token]
+    self._version += 1
+    return True
 
   def listar(self) -> List[Mensaje]:
     """
-    Devuelve una lista de todos los mensajes en la carpeta.
+    Devuelve los mensajes de la carpeta en orden de llegada.
     """
-    return list(self._mensajes)
+    return list(self._mensajes.values())
 
   def buscar_por_asunto(self, clave: str) -> List[Mensaje]:
     """
     Busca mensajes cuyo asunto contenga la clave (no sensible a mayúsculas).
-    """
-    clave_low = clave.lower()
-    return [m for m in self._mensajes if clave_low in m.asunto.lower()]
+    Las consultas repetidas sobre una carpeta sin cambios se sirven desde una
+    caché LRU; la versión de la carpeta forma parte de la clave de caché, así
+    que cualquier alta o baja invalida los resultados viejos sin trabajo extra.
+    """
+    clave_cf = clave.casefold().encode('utf-8')
+    return list(self._buscar_cache(self._version, clave_cf))
+
+  def _buscar_sin_cache(self, version: int, clave_cf: bytes) -> tuple:
+    """
+    Búsqueda real, sin caché. La comparación se hace sobre los asuntos ya
+    normalizados (casefold) y codificados a bytes: el 'in' de bytes usa el
+    fastsearch en C de CPython. Para claves de varias palabras usa el índice
+    invertido: las palabras interiores de la clave deben aparecer completas
+    en el asunto, así que la intersección de sus postings reduce los
+    candidatos antes del filtrado final. Devuelve una tupla (inmutable, apta
+    para quedar en la caché); 'version' solo participa de la clave de caché.
+    """
+    tokens = clave_cf.split()
+    candidatos = None
+    if len(tokens) >= 3:
+      # Las palabras del medio aparecen completas en cualquier coincidencia;
+      # la primera y la última pueden ser parciales, por eso no se indexan aquí.
+      for token in tokens[1:-1]:
+        postings = self._token_index.get(token)
+        if not postings:
+          return ()
+        candidatos = postings if candidatos is None else candidatos & postings
+    mensajes = self._mensajes
+    if candidatos is not None:
+      encontrados = [mensajes[mid] for mid in candidatos if clave_cf in mensajes[mid]._asunto_cf]
+      encontrados.sort(key=lambda m: m.timestamp_ns) # Orden cronológico (≈ llegada)
+      return tuple(encontrados)
+    # Barrido completo: values() recorre el arreglo compacto de entradas del
+    # dict y el asunto normalizado ya está precalculado en cada mensaje.
+    return tuple(m for m in mensajes.values() if clave_cf in m._asunto_cf)
 
   def __repr__(self) -> str:
     """Representación legible de la carpeta para depuración."""
@@ -138,14 +194,18 @@ class Carpeta:
 class Usuario:
   """
   Representa un usuario del sistema de correo.
-  Cada usuario tiene un email, un nombre y varias carpetas (INBOX, SENT, TRASH, etc).
+  Cada usuario tiene un email, un nombre, varias carpetas (INBOX, SENT, TRASH, etc)
+  y sus propias banderas por mensaje (leído, importante, ...), de modo que el
+  mismo Mensaje pueda compartirse entre destinatarios sin pisarse el estado.
   """
+  __slots__ = ('_email', '_nombre', '_carpetas', '_inbox', '_sent', '_trash', '_flags')
+
   def __init__(self, email: str, nombre: str):
     """
     Inicializa el usuario con su email y nombre.
     Crea las carpetas básicas por defecto.
     """
-    self._email = email.lower()
+    self._email = _lower_email(email)
     self._nombre = nombre
     # Carpetas por nombre (Inbox, Enviados, Papelera, personalizado...)
     self._carpetas: Dict[str, Carpeta] = {
@@ -153,6 +213,12 @@ class Usuario:
       'SENT': Carpeta('SENT'),
       'TRASH': Carpeta('TRASH')
     }
+    # Referencias directas a las carpetas por defecto: los caminos calientes
+    # de entrega evitan el upper() + lookup de obtener_carpeta en cada llamada
+    self._inbox = self._carpetas['INBOX']
+    self._sent = self._carpetas['SENT']
+    self._trash = self._carpetas['TRASH']
+    self._flags: Dict[bytes, int] = {} # Máscara de banderas por id de mensaje, según _FLAG_BITS
 
   @property
   def email(self) -> str:
@@ -197,10 +263,10 @@ class Usuario:
     Crea el mensaje, lo envía y guarda una copia en la carpeta SENT.
     """
     mensaje = Mensaje(remitente=self._email, destinatarios=destinatarios, asunto=asunto, cuerpo=cuerpo)
-    ok = server.enviar_email(mensaje)
+    ok, _faltantes = server.enviar_email(mensaje)
     if ok:
       # Guardar copia en carpeta SENT
-      self.obtener_carpeta('SENT').agregar(mensaje)
+      self._sent.agregar(mensaje)
       return mensaje
     else:
       raise RuntimeError('Fallo al enviar el mensaje')
@@ -209,7 +275,34 @@ class Usuario:
     """
     Recibe un mensaje y lo coloca en la carpeta INBOX.
     """
-    self.obtener_carpeta('INBOX').agregar(mensaje)
+    self._inbox.agregar(mensaje)
+
+  def recibir_lote(self, mensajes: List[Mensaje]) -> None:
+    """
+    Recibe varios mensajes de una vez en la carpeta INBOX.
+    """
+    self._inbox.agregar_lote(mensajes)
+
+  # Métodos para banderas (flags): estado propio del usuario, no del mensaje
+  def marcar(self, mensaje: Mensaje, flag: str) -> None:
+    """
+    Marca un mensaje con una bandera para este usuario (por ejemplo, 'leído').
+    """
+    self._flags[mensaje.id] = self._flags.get(mensaje.id, 0) | _flag_bit(flag)
+
+  def desmarcar(self, mensaje: Mensaje, flag: str) -> None:
+    """
+    Elimina una bandera de un mensaje para este usuario.
+    """
+    mascara = self._flags.get(mensaje.id)
+    if mascara is not None:
+      self._flags[mensaje.id] = mascara & ~_FLAG_BITS.get(flag, 0)
+
+  def tiene_flag(self, mensaje: Mensaje, flag: str) -> bool:
+    """
+    Verifica si este usuario marcó el mensaje con una bandera específica.
+    """
+    return bool(self._flags.get(mensaje.id, 0) & _FLAG_BITS.get(flag, 0))
 
   def __repr__(self) -> str:
     """Representación legible del usuario para depuración."""
@@ -221,6 +314,8 @@ class ServidorCorreo:
   Representa el servidor de correo.
   Gestiona los usuarios y la entrega de mensajes entre ellos.
   """
+  __slots__ = ('_usuarios',)
+
   def __init__(self):
     """
     Inicializa el servidor con un diccionario vacío de usuarios.
@@ -232,7 +327,7 @@ class ServidorCorreo:
     Registra un nuevo usuario en el servidor.
     Lanza un error si el usuario ya existe.
     """
-    key = email.lower()
+    key = _lower_email(email)
     if key in self._usuarios:
       raise ValueError('Usuario ya registrado')
     usuario = Usuario(email=key, nombre=nombre)
@@ -243,24 +338,53 @@ class ServidorCorreo:
     """
     Devuelve el usuario con el email dado, o None si no existe.
     """
-    return self._usuarios.get(email.lower())
+    return self._usuarios.get(_lower_email(email))
 
   # Envio sincrono: entrega inmediata a los destinatarios existentes
-  def enviar_email(self, mensaje: Mensaje) -> bool:
+  def enviar_email(self, mensaje: Mensaje) -> tuple[bool, List[str]]:
     """
     Entrega el mensaje a todos los destinatarios registrados en el servidor.
-    Devuelve True si al menos uno lo recibió, False si ninguno existe.
+    Devuelve (entregados, faltantes): si al menos uno lo recibió y la lista
+    de destinatarios inexistentes. Los faltantes se registran en un único
+    aviso de log al final, en vez de imprimir (y pagar un write) por cada uno.
     """
     entregados = False
+    faltantes: List[str] = []
+    usuarios = self._usuarios
     for dest in mensaje.destinatarios:
-      usuario = self.obtener_usuario(dest)
+      usuario = usuarios.get(_lower_email(dest))
       if usuario:
         usuario.recibir(mensaje)
         entregados = True
       else:
         # En una implementacion real podriamos poner en cola o enviar NDR
-        print(f"Advertencia: destinatario {dest} no existe en el servidor")
-    return entregados
+        faltantes.append(dest)
+    if faltantes:
+      logger.warning('Destinatarios inexistentes en el servidor: %s', faltantes)
+    return entregados, faltantes
+
+  def enviar_bulk(self, mensajes: List[Mensaje]) -> List[str]:
+    """
+    Entrega un lote de mensajes (por ejemplo, una importación o migración).
+    Agrupa los mensajes por destinatario y hace una sola inserción masiva por
+    bandeja, amortizando las llamadas por mensaje de enviar_email.
+    Devuelve la lista de destinatarios inexistentes.
+    """
+    por_usuario: Dict[Usuario, List[Mensaje]] = {}
+    faltantes: List[str] = []
+    usuarios = self._usuarios
+    for mensaje in mensajes:
+      for dest in mensaje.destinatarios:
+        usuario = usuarios.get(_lower_email(dest))
+        if usuario:
+          por_usuario.setdefault(usuario, []).append(mensaje)
+        else:
+          faltantes.append(dest)
+    for usuario, lote in por_usuario.items():
+      usuario.recibir_lote(lote)
+    if faltantes:
+      logger.warning('Destinatarios inexistentes en el servidor: %s', faltantes)
+    return faltantes
 
   def listar_usuarios(self) -> List[str]:
     """